@@ -1,19 +1,49 @@
 import sublime
 import sublime_plugin
+import configparser
+import contextlib
 import os
 import time
 import subprocess
 import json
 import re
 import shutil
+import threading
 
 # constants
 EXIT_CODE_CONFIG_PARSE_ERROR = 103
 EXIT_CODE_API_KEY_ERROR = 104
 VERSION = "0.0.1"
 HOME_FOLDER = os.path.realpath(os.path.expanduser("~"))
-CONFIG_FILE = os.join.path(HOME_FOLDER, ".eztracker.cfg") 
+CONFIG_FILE = os.path.join(HOME_FOLDER, ".eztracker.cfg")
 PLUGIN_NAME = "eztracker-sublime"
+_PLUGIN_UA = f"{PLUGIN_NAME}/{VERSION}"
+# Mirrors EztrackerConfig.debug (and its default) as a plain global so log sites skip the attribute lookups
+_DEBUG = True
+# Non-file buffers that are never tracked, cheapest checks first
+_IGNORE_EXACT = frozenset({"--NO NAME--"})
+_IGNORE_PREFIXES = ("term:",)
+_IGNORE_SUBSTR = ("MiniBufExplorer",)
+# A single trailing $ that isn't escaped as \$
+_TRAILING_ANCHOR = re.compile(r"(?<!\\)\$$")
+# Map common extensions (without the dot) to languages
+_EXT_LANG = {
+	"py": "python",
+	"go": "go",
+	"js": "javascript",
+	"ts": "typescript",
+	"java": "java",
+	"cpp": "cpp",
+	"c": "c",
+	"cs": "csharp",
+	"rb": "ruby",
+	"php": "php",
+	"html": "html",
+	"css": "css",
+	"json": "json",
+	"md": "markdown",
+	"odin": "odin",
+}
 
 class EztrackerConfig:
 	def __init__(self):
@@ -23,51 +53,59 @@ class EztrackerConfig:
 		self.heartbeat_frequency = 2 # minutes
 		self.cli_path = "eztracker_cli"
 		self.send_buffer_seconds = 30
+		# Each pattern must match a whole base name, a trailing $ is optional
 		self.ignore_patterns = [
             r"COMMIT_EDITMSG$",
             r"PULLREQ_EDITMSG$",
             r"MERGE_MSG$",
             r"TAG_EDITMSG$",
 		]
+		self.compile_ignore_patterns()
+
+	def compile_ignore_patterns(self):
+		# Patterns are fullmatched against the base name, so a single trailing
+		# unescaped $ anchor is redundant and dropped
+		self._ignore_re = re.compile("|".join(
+			f"(?:{_TRAILING_ANCHOR.sub('', p)})" for p in self.ignore_patterns
+		))
 
 	def load(self):
-		# Load from config file
+		# Load from config file. Sections may repeat since the debug command appends
+		# to the file, so parse non-strictly and let the last value win.
+		parser = configparser.ConfigParser(strict=False, interpolation=None)
+		global _DEBUG
+		_DEBUG = self.debug
 		try:
-			with open(CONFIG_FILE, "r") as f:
-				lines = f.readlines()
-				print(lines)
-				for line in lines:
-					line = line.strip()
-					if not line or line.startswith(("#", ";")):
-						continue
-					if line.startswith("[") and line.endswith("]"):
-						current_section = line.strip("[]")
-						continue
-					if current_section == "settings":
-						parts = line.split("=", 1)
-						if len(parts) != 2:
-							continue
-						key, value = parts[0].strip(), parts[1].strip()
-						if key == "api_key":
-							self.api_key = value
-						elif key == "server_url":
-							self.server_url = value
-						elif key == "debug":
-							self.debug = value.lower() == "true"
-						elif key == "heartbeat_frequency":
-							try:
-								self.heartbeat_frequency = float(value)
-							except ValueError:
-								pass
-		except FileNotFoundError:
-			if self.debug:
-				print("[Eztracker] file not found error")
-			pass
+			try:
+				if not parser.read(CONFIG_FILE):
+					log_debug("Config file not found: %s", CONFIG_FILE)
+			except configparser.MissingSectionHeaderError:
+				raise
+			except configparser.ParsingError as e:
+				# The lines that did parse are already in parser, skip the bad ones
+				# like the old line loop did
+				log_debug("Skipping malformed lines in %s: %s", CONFIG_FILE, e)
+			if parser.has_section("settings"):
+				settings = parser["settings"]
+				self.api_key = settings.get("api_key", self.api_key)
+				self.server_url = settings.get("server_url", self.server_url)
+				try:
+					self.debug = settings.getboolean("debug", self.debug)
+				except ValueError:
+					self.debug = False
+				_DEBUG = self.debug
+				try:
+					self.heartbeat_frequency = settings.getfloat("heartbeat_frequency", self.heartbeat_frequency)
+				except ValueError:
+					pass
+		except configparser.Error as e:
+			sublime.message_dialog(f"[Eztracker] Error parsing {CONFIG_FILE}: {e}")
+			return False
 		except Exception as e:
-			if self.debug:
-				print(f"[Eztracker] Error loading config: {e}")
+			log_debug("Error loading config: %s", e)
 
-		log_debug("LOG API KEY {self.api_key}")
+		self.compile_ignore_patterns()
+		log_debug("API key loaded: %s", bool(self.api_key))
 		if not self.api_key:
 			sublime.message_dialog(
 				"[Eztracker] API key not found. Set API_KEY env var or add to ~/.eztracker.cfg"
@@ -79,35 +117,52 @@ class EztrackerState:
 	def __init__(self):
 		self.initialized = False
 		self.config = EztrackerConfig()
-		self.last_heartbeat = {} # {"file": {"last_activity_at:": 0, "last_heartbeat_at": 0}}
+		self.last_heartbeat = {} # {"file": last_heartbeat_at}
 		self.heartbeat_buffer = []
-		self.last_sent = time.time()
-
-	def get_last_heartbeat(self, file):
-		return self.last_heartbeat.get(file, {"last_activity_at:": 0, "last_heartbeat_at": 0})
+		self.language_cache = {} # {"file": "language"}
+		self.buffer_oldest_ts = None # insertion time of the oldest buffered heartbeat
+		self.cli_proc = None
+		self.send_in_flight = False
+		self._buf_lock = threading.Lock() # heartbeat_buffer is flushed from the async thread
+		self.resolved_cli_path = None
 
-	def set_last_heartbeat(self, file, last_activity_at, last_heartbeat_at):
-		self.last_heartbeat[file] = {
-			"last_activity_at": last_activity_at,
-			"last_heartbeat_at": last_heartbeat_at
-		}
-		print(f"set_last_heartbeat {self.last_heartbeat}")
+	def _resolve_cli(self):
+		# Walking PATH is only done once, the result is reused for every send
+		if self.resolved_cli_path is None:
+			cli_path = self.config.cli_path
+			self.resolved_cli_path = cli_path if os.path.isfile(cli_path) else shutil.which(cli_path)
+		return self.resolved_cli_path
 
 state = EztrackerState()
 
-def log_debug(message):
-	if state.config.debug:
-		print(f"[Eztracker] {message}")
+def log_debug(message, *args):
+	# Callers pass format args so nothing is formatted unless debug is on
+	if not _DEBUG:
+		return
+	print("[Eztracker] " + (message % args if args else message))
 
 def is_ignored_file(file):
 	if not file:
 		return True
-	for pattern in state.config.ignore_patterns:
-		if re.search(pattern, file):
+	if file in _IGNORE_EXACT or file.startswith(_IGNORE_PREFIXES):
+		return True
+	if state.config._ignore_re.fullmatch(os.path.basename(file)):
+		return True
+	for s in _IGNORE_SUBSTR:
+		if s in file:
 			return True
-	return file.startswith("term:") or "MiniBufExplorer" in file or file == "--NO NAME--"
+	return False
 
 def get_file_language(view):
+    # A file's language doesn't change during a session, only resolve it once
+    # Only called for views with a file name, see append_heartbeat
+    file_name = view.file_name()
+    language = state.language_cache.get(file_name)
+    if language is None:
+        language = state.language_cache[file_name] = detect_file_language(view)
+    return language
+
+def detect_file_language(view):
     # Get the scope name at the start of the buffer
     if view:
         scope = view.scope_name(0).strip()
@@ -121,123 +176,175 @@ def get_file_language(view):
     # Fallback: Use file extension if available
     file_name = view.file_name()
     if file_name:
-        extension = os.path.splitext(file_name)[1].lower()
-        # Map common extensions to languages
-        extension_map = {
-            ".py": "python",
-            ".go": "go",
-            ".js": "javascript",
-            ".ts": "typescript",
-            ".java": "java",
-            ".cpp": "cpp",
-            ".c": "c",
-            ".cs": "csharp",
-            ".rb": "ruby",
-            ".php": "php",
-            ".html": "html",
-            ".css": "css",
-            ".json": "json",
-            ".md": "markdown",
-            ".odin": "odin",
-        }
-        return extension_map.get(extension, "")
+        # Partition the base name so dotfiles like ".py" have no extension, as with splitext
+        head, _, extension = os.path.basename(file_name).rpartition(".")
+        return _EXT_LANG.get(extension.lower(), "") if head else ""
     
     return ""  # Return empty string if no language can be determined
 
 def append_heartbeat(view, is_write):
 	file = view.file_name()
-	if not file or is_ignored_file(file):
-		log_debug("Ignoring file: {file}")
+	now = time.time()
+	last_hb_at = state.last_heartbeat.get(file)
+	is_new = last_hb_at is None
+	# Files that already have an entry passed is_ignored_file when it was created
+	if is_new and is_ignored_file(file):
+		log_debug("Ignoring file: %s", file)
 		return
 
-	now = time.time()
-	last = state.get_last_heartbeat(file)
-	print(f"153 {last}")
-	enough_time_passed = (now - last["last_heartbeat_at"]) > (
-		state.config.heartbeat_frequency * 60
+	enough_time_passed = is_new or (now - last_hb_at) > state.config.heartbeat_frequency * 60
+	if is_write or enough_time_passed:
+		duration = 0 if is_new else now - last_hb_at
+		# A zero-duration heartbeat records nothing, only start the clock for the file
+		if duration == 0 and not is_write:
+			log_debug("Duration is 0, not buffering heartbeat for %s", file)
+		else:
+			heartbeat = {
+				"entity": file,
+				"time": str(now),
+				"is_write": is_write,
+				"duration": duration,
+				"language": get_file_language(view)
+			}
+			with state._buf_lock:
+				state.heartbeat_buffer.append(heartbeat)
+				first = len(state.heartbeat_buffer) == 1
+				if first:
+					state.buffer_oldest_ts = now
+			if first:
+				# Flush even if no further event arrives, e.g. the user goes idle
+				# (rounded up a millisecond so the deadline has passed when the timer fires)
+				sublime.set_timeout_async(send_heartbeats_if_due, int(state.config.send_buffer_seconds * 1000) + 1)
+		state.last_heartbeat[file] = now
+
+	# The timer above bounds how long a heartbeat stays buffered, this just
+	# flushes sooner when an event arrives after the deadline
+	if state.send_in_flight:
+		return
+	if state.buffer_oldest_ts and (now - state.buffer_oldest_ts) >= state.config.send_buffer_seconds:
+		# Flush on Sublime's worker thread so writing to the CLI never blocks typing
+		state.send_in_flight = True
+		sublime.set_timeout_async(send_heartbeats, 0)
+
+def heartbeat_to_json(hb):
+	# Shape expected by the CLI's Heartbeat struct
+	language = hb["language"]
+	lang_key = "language" if language.lower() == "forth" else "alternate_language"
+	return {
+		"entity": hb["entity"],
+		"timestamp": float(hb["time"]),
+		"is_write": hb["is_write"],
+		"duration": hb["duration"],
+		lang_key: language,
+	}
+
+def get_cli_proc():
+	# The CLI is spawned once and kept alive, heartbeats are streamed to its stdin
+	proc = state.cli_proc
+	if proc is not None and proc.poll() is None:
+		return proc
+	if proc is not None:
+		reap_cli(proc)
+		if not state.initialized:
+			return None
+	state.cli_proc = subprocess.Popen(
+		[state._resolve_cli(), "--stream", "--plugin", _PLUGIN_UA],
+		stdin=subprocess.PIPE,
+		stdout=subprocess.DEVNULL,
+		text=True,
 	)
-	if state.debug
-		print(f"is_write {is_write} enough_time_passed {enough_time_passed} {file} file not in {file not in state.last_heartbeat}")
-	if is_write or enough_time_passed or file not in state.last_heartbeat:
-		print(f"last {last}")
-		duration = now - last["last_heartbeat_at"] if file in state.last_heartbeat else 0
-		heartbeat = {
-			"entity": file,
-			"time": str(now),
-			"is_write": is_write,
-			"duration": duration,
-			"language": get_file_language(view)
-		}
-		state.heartbeat_buffer.append(heartbeat)
-		state.set_last_heartbeat(file, now, now)
-		print(f"Append heartbeat for {file} (write: {is_write}, duration: {duration})")
-		
-	# Check if it's time to send buffered heartbeats
-	if not isinstance(state.last_sent, (int, float)):
-		state.last_sent = time.time()
-	if now - state.last_sent > state.config.send_buffer_seconds and state.heartbeat_buffer:
+	return state.cli_proc
+
+def close_cli_stdin(proc):
+	# Writes still buffered for a dead CLI are dropped instead of warning at GC
+	with contextlib.suppress(OSError):
+		proc.stdin.close()
+
+def reap_cli(proc):
+	close_cli_stdin(proc)
+	if state.cli_proc is proc:
+		state.cli_proc = None
+	report_cli_exit(proc.wait())
+
+def report_cli_exit(returncode):
+	if returncode == EXIT_CODE_API_KEY_ERROR:
+		sublime.message_dialog("[Eztracker] Invalid API Key. Update in ~/.eztracker.cfg")
+		state.initialized = False
+	elif returncode == EXIT_CODE_CONFIG_PARSE_ERROR:
+		sublime.message_dialog(f"[Eztracker] CLI error (code {returncode})")
+	else:
+		log_debug("CLI exited with code %s", returncode)
+
+def write_to_cli(line):
+	proc = get_cli_proc()
+	if proc is None:
+		return
+	try:
+		proc.stdin.write(line)
+		proc.stdin.flush()
+	except BrokenPipeError:
+		# The CLI exited since the last send, respawn it and retry once
+		reap_cli(proc)
+		if not state.initialized:
+			return
+		proc = get_cli_proc()
+		proc.stdin.write(line)
+		proc.stdin.flush()
+
+	# Report a CLI that exited right away (e.g. no API key) with this batch
+	# rather than the next one. An exit that races this check still loses
+	# the batch and is reported by get_cli_proc on the next send.
+	if proc.poll() is not None:
+		reap_cli(proc)
+
+def send_heartbeats_if_due():
+	# Timers from earlier buffers can fire after that buffer was already flushed
+	oldest_ts = state.buffer_oldest_ts
+	if oldest_ts and (time.time() - oldest_ts) >= state.config.send_buffer_seconds:
 		send_heartbeats()
 
 def send_heartbeats():
-	if not state.heartbeat_buffer:
-		state.last_sent = time.time()
-		return
+	try:
+		flush_heartbeats()
+	finally:
+		state.send_in_flight = False
 
-	if not os.path.isfile(state.config.cli_path) and not shutil.which(state.config.cli_path):
+def flush_heartbeats():
+	# Snapshot the buffer so the main thread can keep appending mid-flush
+	with state._buf_lock:
+		batch = state.heartbeat_buffer
 		state.heartbeat_buffer = []
+		state.buffer_oldest_ts = None
+
+	if not batch:
+		return
+
+	if not state._resolve_cli():
 		return
 
 	# Take the first heartbeat for main args
-	heartbeat = state.heartbeat_buffer.pop(0)
-	extra_heartbeats = state.heartbeat_buffer
-	state.heartbeat_buffer = []
+	heartbeat, extra_heartbeats = batch[0], batch[1:]
 
-	if heartbeat["duration"] == 0:
-		log_debug("Duration is 0, not sending heartbeat")
-		return
+	line = json.dumps({
+		"main": heartbeat_to_json(heartbeat),
+		"extra": [heartbeat_to_json(hb) for hb in extra_heartbeats],
+	}, separators=(",", ":"))
 
-	cmd = [
-		state.config.cli_path,
-		"--entity", heartbeat["entity"],
-		"--time", heartbeat["time"],
-		"--plugin", "{PLUGIN_NAME}/{VERSION}"
-	]
-
-	if heartbeat["duration"] != 0:
-		cmd.extend(["--duration", str(heartbeat["duration"])])
-	if heartbeat["is_write"]:
-		cmd.append("--write")
-	if heartbeat["language"]:
-		cmd.extend(["--language" if heartbeat["language"].lower() == "forth" else
-			"--alternate-language", heartbeat["language"]])
-	if extra_heartbeats:
-		cmd.extend(["--extra-heartbeats", json.dumps([{
-			"entity": hb["entity"],
-			"timestamp": float(hb["time"]),
-			"is_write": hb["is_write"],
-			"duration": hb["duration"],
-			"language" if hb["language"].lower() == "forth" else 
-				"alternate_language": hb["language"]
-		} for hb in extra_heartbeats])])
-
-	log_debug("Sending heartbeat: {' .join(cmd)'}" )
+	log_debug("Sending heartbeat: %s", line)
 	try:
-		result = subprocess.run(cmd, capture_output=True, text=True)
-		if result.returncode == EXIT_CODE_API_KEY_ERROR:
-			sublime.message_dialog("[Eztracker] Invalid API Key. Update in ~/.eztracker.cfg")
-			state.initialized = False
-		elif result.returncode == EXIT_CODE_CONFIG_PARSE_ERROR:
-			sublime.message_dialog(
-				"[Eztracker] CLI error (code {result.returncode}): {result.stderr}"
-			)
-		elif state.config.debug:
-			log_debug("CLI output: {result.stdout}")
+		write_to_cli(line + "\n")
 	except FileNotFoundError:
-		sublime.message_dialog("[Eztracker] CLI not found: {state.config.cli_path}")
+		state.resolved_cli_path = None
+		sublime.message_dialog(f"[Eztracker] CLI not found: {state.config.cli_path}")
 	except Exception as e:
-		sublime.message_dialog("[Eztracker] Error running CLI: {e}")
+		sublime.message_dialog(f"[Eztracker] Error running CLI: {e}")
 
-	state.last_sent = time.time()
+def plugin_unloaded():
+	# Closing stdin lets the CLI send what it has already read and exit
+	proc = state.cli_proc
+	if proc is not None:
+		state.cli_proc = None
+		close_cli_stdin(proc)
 
 class EztrackerListener(sublime_plugin.EventListener):
 	def on_init(self, views):
@@ -249,6 +356,8 @@ class EztrackerListener(sublime_plugin.EventListener):
 				append_heartbeat(view, False)
 
 	def on_load(self, view):
+		# Drop any language detected before the file was (re)loaded
+		state.language_cache.pop(view.file_name(), None)
 		if state.initialized:
 			append_heartbeat(view, False)
 
@@ -256,30 +365,22 @@ class EztrackerListener(sublime_plugin.EventListener):
 		if state.initialized:
 			append_heartbeat(view, False)
 
-	def on_modified(self, view):
-		if state.initialized:
-			file = view.file_name()
-			if file and not is_ignored_file(file):
-				now = time.time()
-				last = state.get_last_heartbeat(file)
-				print(f"on_modified {last}")
-				state.set_last_heartbeat(file, now, last["last_heartbeat_at"])
-
 	def on_text_command(self, view, command_name, args):
 		if state.initialized and command_name == "save":
 			append_heartbeat(view, True)
 
 class EztrackerDebugCommand(sublime_plugin.ApplicationCommand):
     def run(self, enable):
+        global _DEBUG
         try:
             config_dir = os.path.dirname(CONFIG_FILE)
             if not os.path.exists(config_dir):
                 os.makedirs(config_dir, mode=0o700)
             with open(CONFIG_FILE, "a") as f:
-                f.write("[settings]\ndebug={str(enable).lower()}\n")
-            state.config.debug = enable
+                f.write(f"[settings]\ndebug={str(enable).lower()}\n")
+            state.config.debug = _DEBUG = enable
             sublime.message_dialog(
-				"[Eztracker] Debug mode {'enabled' if enable else 'disabled'}."
+				f"[Eztracker] Debug mode {'enabled' if enable else 'disabled'}."
             )
         except Exception as e:
-            sublime.message_dialog("[Eztracker] Error setting debug mode: {e}")
\ No newline at end of file
+            sublime.message_dialog(f"[Eztracker] Error setting debug mode: {e}")
\ No newline at end of file
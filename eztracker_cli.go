@@ -1,6 +1,7 @@
 package main
 
 import (
+	"bufio"
 	"bytes"
 	"encoding/json"
 	"flag"
@@ -36,6 +37,12 @@ type Heartbeat struct {
 	Duration          float64 `json:"duration"`
 }
 
+// StreamBatch is one newline-delimited JSON line read from stdin in --stream mode
+type StreamBatch struct {
+	Main  Heartbeat   `json:"main"`
+	Extra []Heartbeat `json:"extra"`
+}
+
 type ServerHeartbeat struct {
 	UserID    string  `json:"user_id"`
 	Project   string  `json:"project"`
@@ -45,6 +52,9 @@ type ServerHeartbeat struct {
 	Timestamp int64   `json:"timestamp"`
 }
 
+// Shared so the connection to the server stays warm across heartbeats in --stream mode
+var httpClient = &http.Client{Timeout: 10 * time.Second}
+
 func loadConfig() (Config, error) {
 	config := Config{
 		ServerURL: "http://localhost:8080", // Default server URL
@@ -122,6 +132,7 @@ func main() {
 	today := flag.Bool("today", false, "Fetch today's summary")
 	version := flag.Bool("version", false, "Show CLI version")
 	duration := flag.Float64("duration", 0.0, "Duration if same file edited")
+	stream := flag.Bool("stream", false, "Read newline-delimited JSON heartbeat batches from stdin")
 	flag.Parse()
 
 	config, err := loadConfig()
@@ -150,6 +161,11 @@ func main() {
 		os.Exit(ExitCodeSuccess)
 	}
 
+	if *stream {
+		streamHeartbeats(config, *plugin)
+		os.Exit(ExitCodeSuccess)
+	}
+
 	if *entity == "" || *timeStr == "" {
 		fmt.Fprintln(os.Stderr, "Error: --entity and --time are required")
 		os.Exit(1)
@@ -203,6 +219,39 @@ func main() {
 	}
 }
 
+// streamHeartbeats sends every batch read from stdin until the plugin closes it
+func streamHeartbeats(config Config, plugin string) {
+	scanner := bufio.NewScanner(os.Stdin)
+	scanner.Buffer(make([]byte, 0, 64*1024), 16*1024*1024)
+	for scanner.Scan() {
+		var batch StreamBatch
+		if err := json.Unmarshal(scanner.Bytes(), &batch); err != nil {
+			fmt.Fprintf(os.Stderr, "Error: Invalid heartbeat batch JSON: %v\n", err)
+			continue
+		}
+
+		failed := false
+		heartbeats := append([]Heartbeat{batch.Main}, batch.Extra...)
+		for _, hb := range heartbeats {
+			if hb.Plugin == "" {
+				hb.Plugin = plugin
+			}
+			if err := sendHeartbeat(config, hb); err != nil {
+				fmt.Fprintf(os.Stderr, "Error sending heartbeat: %v\n", err)
+				failed = true
+			}
+		}
+
+		if config.Debug && !failed {
+			fmt.Println("Debug: Heartbeats sent successfully")
+		}
+	}
+	if err := scanner.Err(); err != nil {
+		fmt.Fprintf(os.Stderr, "Error reading heartbeats: %v\n", err)
+		os.Exit(1)
+	}
+}
+
 func sendHeartbeat(config Config, hb Heartbeat) error {
 	if hb.Duration == 0 {
 		fmt.Printf("duration is 0, not sending it: %+v", hb)
@@ -246,8 +295,7 @@ func sendHeartbeat(config Config, hb Heartbeat) error {
 	req.Header.Set("Content-Type", "application/json")
 	req.Header.Set("User-Agent", hb.Plugin)
 
-	client := &http.Client{Timeout: 10 * time.Second}
-	resp, err := client.Do(req)
+	resp, err := httpClient.Do(req)
 	if err != nil {
 		return fmt.Errorf("failed to send request: %v", err)
 	}